@@ -278,16 +278,18 @@ class MEGALock(tm):
         self.lifetime = lifetime
         self.re_entries = 0
 
-        self.thread_lock = threading.Lock()
+        self.thread_lock = threading.RLock()
         self.flufl_lock = flufl.lock.Lock(flufl_fp, lifetime=lifetime)
 
     def __enter__(self):
         """ We acquire the thread lock first because the flufl lock isn't
-        thread-safe which is why we need both locks in the first place
+        thread-safe which is why we need both locks in the first place. The
+        thread lock is reentrant, so only the thread holding it can re-enter,
+        and re_entries is only ever touched by that thread.
         """
-        if self.re_entries == 0:
-            self.thread_lock.acquire()
+        self.thread_lock.acquire()
 
+        if self.re_entries == 0:
             try:
                 self.flufl_lock.lock()
             except Exception:
@@ -302,7 +304,8 @@ class MEGALock(tm):
 
         if self.re_entries == 0:
             self.flufl_lock.unlock()
-            self.thread_lock.release()
+
+        self.thread_lock.release()
 
     def __getstate__(self):
         lockless_dict = self.__dict__.copy()
@@ -315,7 +318,9 @@ class MEGALock(tm):
     def __setstate__(self, state):
         self.__dict__.update(state)
 
-        self.thread_lock = threading.Lock()
+        # Whoever pickled us may have been holding the lock, we are not
+        self.re_entries = 0
+        self.thread_lock = threading.RLock()
         self.flufl_lock = \
             flufl.lock.Lock(self.flufl_fp, lifetime=self.lifetime)
 
@@ -17,6 +17,7 @@ import psutil
 import random
 import platform
 import tempfile
+import threading
 import unittest
 from contextlib import contextmanager
 
@@ -275,6 +276,41 @@ class TestCache(unittest.TestCase):
 
         self.assertEqual(self.cache.lock.flufl_lock.state, LockState.unlocked)
 
+    def test_lock_excludes_other_threads(self):
+        """Make sure holding the lock (even reentrantly) keeps other threads
+        out until we have fully released it
+        """
+        entered = threading.Event()
+
+        def _enter():
+            with self.cache.lock:
+                entered.set()
+
+        with self.cache.lock:
+            with self.cache.lock:
+                thread = threading.Thread(target=_enter)
+                thread.start()
+                self.assertFalse(entered.wait(timeout=.5))
+            self.assertFalse(entered.wait(timeout=.5))
+
+        thread.join()
+        self.assertTrue(entered.is_set())
+        self.assertEqual(self.cache.lock.re_entries, 0)
+
+    def test_lock_unpickles_unheld(self):
+        """A lock pickled while held must not come back thinking it is held
+        """
+        with self.cache.lock:
+            state = self.cache.lock.__getstate__()
+
+        lock = self.cache.lock.__class__.__new__(self.cache.lock.__class__)
+        lock.__setstate__(state)
+        self.assertEqual(lock.re_entries, 0)
+
+        with lock:
+            self.assertEqual(lock.re_entries, 1)
+        self.assertEqual(lock.re_entries, 0)
+
     # Might create another class for garbage collection tests to test more
     # cases with shared boilerplate
     def test_garbage_collection(self):
@@ -712,13 +712,27 @@ class HashableInvocation():
 
         unified_arguments = self._unify_dicts(arguments)
         self.arguments = self._make_hashable(unified_arguments)
+        # We are probed against the pool index repeatedly, so only hash the
+        # (potentially deeply nested) arguments once
+        self._hash = hash((self.plugin_action, self.arguments))
 
     def __eq__(self, other):
         return (self.plugin_action == other.plugin_action) \
               and (self.arguments == other.arguments)
 
     def __hash__(self):
-        return hash((self.plugin_action, self.arguments))
+        return self._hash
+
+    def __getstate__(self):
+        # String hashes are salted per process, so the hash must be
+        # recomputed wherever we are unpickled
+        state = self.__dict__.copy()
+        del state['_hash']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._hash = hash((self.plugin_action, self.arguments))
 
     def __repr__(self):
         return (f'\nPLUGIN_ACTION: {self.plugin_action}\nARGUMENTS:'
@@ -729,7 +743,7 @@ class HashableInvocation():
         unify
         """
         for idx, argument in enumerate(arguments):
-            name, value = list(argument.items())[0]
+            name, value = next(iter(argument.items()))
             if isinstance(value, list) and \
                     all(isinstance(x, dict) for x in value):
                 arguments[idx] = {name: self._unify_dict(value)}
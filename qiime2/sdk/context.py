@@ -6,14 +6,155 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import sys
+import weakref
+import functools
+from itertools import chain
+
 from qiime2.core.type.util import is_collection_type
 from qiime2.core.type import HashableInvocation
 from qiime2.core.cache import get_cache
+from qiime2.metadata.metadata import _MetadataBase
 import qiime2.sdk
 from qiime2.sdk.parallel_config import PARALLEL_CONFIG
+from qiime2.sdk.plugin_manager import PluginManager
+from qiime2.sdk.proxy import Proxy
+
+
+@functools.lru_cache(maxsize=256)
+def _normalize_names(plugin, action):
+    """Get the normalized plugin name and the plugin:action string used in
+    invocations. Both are interned, as they are used as keys throughout
+    provenance and the pool index.
+    """
+    plugin = sys.intern(plugin.replace('_', '-'))
+    plugin_action = sys.intern(plugin + ':' + action)
+
+    return plugin, plugin_action
+
+
+@functools.lru_cache(maxsize=512)
+def _resolve_action(plugin, action):
+    """Look up the action object for a plugin and action name.
+
+    Resolution is idempotent for a given (plugin, action) pair, so the result
+    is memoized. The cache is cleared whenever the PluginManager's plugins
+    change.
+    """
+    pm = PluginManager()
+    try:
+        plugin_obj = pm.plugins[plugin]
+    except KeyError:
+        raise ValueError("A plugin named %r could not be found." % plugin)
+
+    try:
+        action_obj = plugin_obj.actions[action]
+    except KeyError:
+        raise ValueError(
+            "An action named %r was not found for plugin %r"
+            % (action, plugin))
+
+    return action_obj
+
+
+PluginManager._register_plugin_change_callback(_resolve_action.cache_clear)
+
+
+class _WeakIdentityKey:
+    """Hashes and compares the wrapped object by identity without keeping it
+    alive. Once the object is gone the key equals nothing, so a new object
+    that reuses its id cannot match it.
+    """
+    __slots__ = ('ref', 'hash')
+
+    def __init__(self, obj):
+        self.ref = weakref.ref(obj)
+        self.hash = id(obj)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        if not isinstance(other, _WeakIdentityKey):
+            return False
+
+        obj = self.ref()
+        return obj is not None and obj is other.ref()
+
+
+def _make_invocation(plugin_action, items):
+    # Make args and kwargs look how they do when we read them out of a .yaml
+    # file (list of single value dicts of input_name: value)
+    return HashableInvocation(plugin_action, [{k: v} for k, v in items])
+
+
+@functools.lru_cache(maxsize=256)
+def _memoized_invocation(plugin_action, key):
+    # We are only called on a miss, from _get_invocation, which still holds
+    # the arguments our weak keys refer to
+    return _make_invocation(
+        plugin_action,
+        ((k, v.ref() if isinstance(v, _WeakIdentityKey) else v)
+         for k, v in key))
+
+
+def _invocation_key(value):
+    # An invocation only records an artifact's uuid, so key on that rather
+    # than the artifact itself, which we must not keep alive
+    if isinstance(value, qiime2.sdk.Artifact):
+        return str(value.uuid)
+    elif isinstance(value, _MetadataBase):
+        return _WeakIdentityKey(value)
+    return value
+
+
+def _get_invocation(plugin_action, callable_args):
+    """Get the HashableInvocation for calling an action with these arguments.
+
+    Building an invocation requires hashing the contents of any Metadata
+    passed to the action, so invocations are memoized. Artifacts are keyed by
+    their uuid and primitives by value. Metadata is keyed by identity, as
+    hashing it is the expensive part we are trying to avoid. None of these
+    keys keep the arguments alive. Anything else that is unhashable (e.g.
+    collections) is not memoized.
+    """
+    key = tuple((k, _invocation_key(v)) for k, v in callable_args.items())
+
+    try:
+        hash(key)
+    except TypeError:
+        return _make_invocation(plugin_action, callable_args.items())
+
+    return _memoized_invocation(plugin_action, key)
+
+
+def _get_executor_name_type_mapping():
+    """Map the label of each executor in the current parallel config to the
+    name of its type. The mapping only changes when the parallel config does,
+    so it is kept on PARALLEL_CONFIG alongside the config it was built from.
+    """
+    parallel_config = PARALLEL_CONFIG.parallel_config
+    if parallel_config is None:
+        return None
+
+    cached = getattr(PARALLEL_CONFIG, '_executor_name_type_mapping', None)
+    if cached is None or cached[0] is not parallel_config:
+        # Cast type to str so yaml doesn't think it needs tpo instantiate an
+        # executor object when we write this to then read this from
+        # provenance
+        mapping = {v.label: v.__class__.__name__
+                   for v in parallel_config.executors}
+        cached = (parallel_config, mapping)
+        PARALLEL_CONFIG._executor_name_type_mapping = cached
+
+    return cached[1]
 
 
 class Context:
+    # A Context is created for every action run in a pipeline
+    __slots__ = ('action_executor_mapping', 'executor_name_type_mapping',
+                 'parallel', 'cache', '_parent')
+
     def __init__(self, parent=None, parallel=False):
         if parent is not None:
             self.action_executor_mapping = parent.action_executor_mapping
@@ -23,13 +164,8 @@ class Context:
         else:
             self.action_executor_mapping = \
                 PARALLEL_CONFIG.action_executor_mapping
-            # Cast type to str so yaml doesn't think it needs tpo instantiate
-            # an executor object when we write this to then read this from
-            # provenance
             self.executor_name_type_mapping = \
-                None if PARALLEL_CONFIG.parallel_config is None \
-                else {v.label: v.__class__.__name__
-                      for v in PARALLEL_CONFIG.parallel_config.executors}
+                _get_executor_name_type_mapping()
             self.parallel = parallel
             self.cache = get_cache()
             # Only ever do this on the root context. We only want to index the
@@ -45,21 +181,8 @@ class Context:
         This function is aware of the pipeline context and manages its own
         cleanup as appropriate.
         """
-        plugin = plugin.replace('_', '-')
-        plugin_action = plugin + ':' + action
-
-        pm = qiime2.sdk.PluginManager()
-        try:
-            plugin_obj = pm.plugins[plugin]
-        except KeyError:
-            raise ValueError("A plugin named %r could not be found." % plugin)
-
-        try:
-            action_obj = plugin_obj.actions[action]
-        except KeyError:
-            raise ValueError(
-                "An action named %r was not found for plugin %r"
-                % (action, plugin))
+        plugin, plugin_action = _normalize_names(plugin, action)
+        action_obj = _resolve_action(plugin, action)
 
         # We return this callable which determines whether to return cached
         # results or to run the action requested.
@@ -74,107 +197,144 @@ class Context:
             # are proxies because if we got a proxy as an argument, we know it
             # is a new thing we are computing from a prior step in the pipeline
             # and thus will not be cached.
-            with self.cache.lock:
-                if self.cache.named_pool is not None and \
-                        not self._contains_proxies(*args, **kwargs):
-
-                    collated_inputs = action_obj.signature.collate_inputs(
-                        *args, **kwargs)
-                    callable_args = action_obj.signature.coerce_user_input(
-                        **collated_inputs)
-
-                    # Make args and kwargs look how they do when we read them
-                    # out of a .yaml file (list of single value dicts of
-                    # input_name: value)
-                    arguments = []
-                    for k, v in callable_args.items():
-                        arguments.append({k: v})
-
-                    invocation = HashableInvocation(plugin_action, arguments)
-                    if invocation in self.cache.named_pool.index:
+            #
+            # None of this requires the cache lock. We check for proxies
+            # first because it is cheaper than getting the named_pool, which
+            # checks the pool still exists on disk.
+            if self._contains_proxies(*args, **kwargs):
+                pool = None
+            else:
+                pool = self.cache.named_pool
+
+            if pool is not None:
+                collated_inputs = action_obj.signature.collate_inputs(
+                    *args, **kwargs)
+                callable_args = action_obj.signature.coerce_user_input(
+                    **collated_inputs)
+                invocation = _get_invocation(plugin_action, callable_args)
+                # The index is only written when the root Context creates it,
+                # so probing it does not need a lock
+                if invocation in pool.index:
+                    # Loading re-enters the cache lock for every result, so
+                    # we take it once for the whole load
+                    with self.cache.lock:
                         # It is conceivable that since we created our index the
                         # pool we indexed has been destroyed. If that is the
                         # case we want to just continue on and rerun the action
                         try:
-                            return self._load_cache(action_obj, invocation)
+                            return self._load_cache(
+                                action_obj, invocation, pool)
                         except KeyError:
                             pass
 
             # If we didn't have cached results to reuse, we need to execute
             # the action.
             #
-            # These factories will create new Contexts with this context as
+            # The factory will create new Contexts with this context as
             # their parent. This allows scope cleanup to happen
             # recursively. A factory is necessary so that independent
             # applications of the returned callable receive their own
             # Context objects.
             #
-            # The parsl factory is a bit more complicated because we need
-            # to pass this exact Context along for a while longer until we
-            # run a normal _bind in action/_run_parsl_action. Then we
-            # create a new Context with this one as its parent inside of
-            # the parsl app
-            def _bind_parsl_context(ctx):
-                def _bind_parsl_args(*args, **kwargs):
-                    return action_obj._bind_parsl(ctx, *args, **kwargs)
-                return _bind_parsl_args
-
+            # Parsl is a bit more complicated because we need to pass this
+            # exact Context along for a while longer until we run a normal
+            # _bind in action/_run_parsl_action. Then we create a new Context
+            # with this one as its parent inside of the parsl app
             if self.parallel:
-                return _bind_parsl_context(self)(*args, **kwargs)
+                return action_obj._bind_parsl(self, *args, **kwargs)
 
-            return action_obj._bind(
-                lambda: Context(parent=self))(*args, **kwargs)
+            return action_obj._bind(self._child_context)(*args, **kwargs)
 
         deferred_action = action_obj._rewrite_wrapper_signature(
             deferred_action)
         action_obj._set_wrapper_properties(deferred_action)
         return deferred_action
 
-    def _load_cache(self, action_obj, invocation):
+    def _child_context(self):
+        """Factory for Contexts that have this Context as their parent.
+        """
+        return Context(parent=self)
+
+    def _load_cache(self, action_obj, invocation, pool):
         """Load cached results
         """
-        cached_outputs = self.cache.named_pool.index[invocation]
+        cached_outputs = pool.index[invocation]
         loaded_outputs = {}
 
-        for name, _type in action_obj.signature.outputs.items():
-            if is_collection_type(_type.qiime_type):
-                loaded_collection = qiime2.sdk.ResultCollection()
-                cached_collection = cached_outputs[name]
+        for name, loader in self._get_output_loaders(action_obj):
+            loaded_outputs[name] = loader(self, pool, cached_outputs[name])
 
-                # Get the order we should load collection items in
-                collection_order = list(cached_collection.keys())
-                self._validate_collection(collection_order)
-                collection_order.sort(key=lambda x: x.idx)
+        return qiime2.sdk.Results(
+            loaded_outputs.keys(), loaded_outputs.values())
 
-                for elem_info in collection_order:
-                    elem = cached_collection[elem_info]
-                    loaded_elem = self.cache.named_pool.load(elem)
-                    loaded_collection[
-                        elem_info.item_name] = loaded_elem
+    def _load_cached_output(self, pool, output):
+        """Load a single cached output
+        """
+        return pool.load(output)
 
-                loaded_outputs[name] = loaded_collection
-            else:
-                output = cached_outputs[name]
-                loaded_outputs[name] = \
-                    self.cache.named_pool.load(output)
+    def _load_cached_collection(self, pool, cached_collection):
+        """Load a cached output collection
+        """
+        loaded_collection = qiime2.sdk.ResultCollection()
 
-        return qiime2.sdk.Results(
-            loaded_outputs.keys(), loaded_outputs.values())
+        # Get the order we should load collection items in
+        collection_order = \
+            self._validate_collection(cached_collection.items())
+
+        for elem_info, elem in collection_order:
+            loaded_collection[elem_info.item_name] = pool.load(elem)
+
+        return loaded_collection
+
+    def _get_output_loaders(self, action_obj):
+        """Get (name, loader) for each of the action's outputs, where loader
+        is the unbound Context method that loads that kind of output. An
+        action's signature does not change, so this is worked out once and
+        kept on the action.
+        """
+        output_loaders = getattr(action_obj, '_qiime_output_loaders', None)
+
+        if output_loaders is None:
+            output_loaders = tuple(
+                (name, Context._load_cached_collection
+                 if is_collection_type(_type.qiime_type)
+                 else Context._load_cached_output)
+                for name, _type in action_obj.signature.outputs.items())
+            action_obj._qiime_output_loaders = output_loaders
+
+        return output_loaders
 
     def _contains_proxies(self, *args, **kwargs):
         """Returns True if any of the args or kwargs are proxies
         """
-        return any(isinstance(arg, qiime2.sdk.proxy.Proxy) for arg in args) \
-            or any(isinstance(value, qiime2.sdk.proxy.Proxy) for
-                   value in kwargs.values())
+        return any(isinstance(arg, Proxy)
+                   for arg in chain(args, kwargs.values()))
 
-    def _validate_collection(self, collection_order):
+    def _validate_collection(self, collection_items):
         """Validate that all indexed items in the collection agree on how
         large the collection should be and that we have that many elements.
+        Takes (indexed element, uuid) pairs and returns them ordered by index.
         """
-        assert all([elem.total == collection_order[0].total
-                    for elem in collection_order])
-        assert len(collection_order) == collection_order[0].total
+        collection_order = None
+        seen = 0
+
+        for item in collection_items:
+            elem_info = item[0]
+            if collection_order is None:
+                total = elem_info.total
+                collection_order = [None] * total
+
+            # Collection indices are recorded 1-based in provenance
+            assert elem_info.total == total
+            assert 0 < elem_info.idx <= total
+            assert collection_order[elem_info.idx - 1] is None
+            collection_order[elem_info.idx - 1] = item
+            seen += 1
+
+        assert collection_order is not None
+        assert seen == total
+
+        return collection_order
 
     def make_artifact(self, type, view, view_type=None):
         """Return a new artifact from a given view.
@@ -195,11 +355,17 @@ class Context:
            failure, a context can still identify what will (no longer) be
            returned.
         """
-        with self.cache.lock:
+        # The pools lock the cache themselves whenever they touch the disk, so
+        # without a named pool there is nothing for us to lock. With one, we
+        # hold the cache lock so the two saves are atomic with respect to
+        # other threads and processes
+        pool = self.cache.named_pool
+        if pool is None:
             new_ref = self.cache.process_pool.save(ref)
-
-            if self.cache.named_pool is not None:
-                self.cache.named_pool.save(new_ref)
+        else:
+            with self.cache.lock:
+                new_ref = self.cache.process_pool.save(ref)
+                pool.save(new_ref)
 
         # Return an artifact backed by the data in the cache
         return new_ref
@@ -404,6 +404,7 @@ class ParallelConfig():
         PARALLEL_CONFIG.dfk = None
         PARALLEL_CONFIG.parallel_config = None
         PARALLEL_CONFIG.action_executor_mapping = {}
+        PARALLEL_CONFIG._executor_name_type_mapping = None
 
 
 # TESTING STUFF #
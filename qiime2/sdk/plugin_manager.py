@@ -31,6 +31,9 @@ class UninitializedPluginManagerError(Exception):
 class PluginManager:
     entry_point_group = 'qiime2.plugins'
     __instance = None
+    # Called with no arguments whenever the available plugins change, so
+    # anything caching lookups into the PluginManager can invalidate itself
+    _plugin_change_callbacks = []
 
     @classmethod
     def iter_entry_points(cls):
@@ -75,6 +78,15 @@ class PluginManager:
                     'current value for `add_plugins`.')
         return cls.__instance
 
+    @classmethod
+    def _register_plugin_change_callback(cls, callback):
+        cls._plugin_change_callbacks.append(callback)
+
+    @classmethod
+    def _plugins_changed(cls):
+        for callback in cls._plugin_change_callbacks:
+            callback()
+
     def forget_singleton(self):
         """Allows later instatiation of PluginManager to produce new object
 
@@ -82,6 +94,7 @@ class PluginManager:
         will NOT invalidate or remove the object this method is called on.
         """
         self.__class__.__instance = None
+        self._plugins_changed()
 
     def _init(self, add_plugins):
         self.plugins = {}
@@ -135,6 +148,7 @@ class PluginManager:
 
         self._integrate_plugin(plugin)
         plugin.freeze()
+        self._plugins_changed()
         if consistency_check is True:
             return self._consistency_check()
 
@@ -0,0 +1,79 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2016-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import gc
+import weakref
+import unittest
+
+import pandas as pd
+
+from qiime2 import Artifact, Metadata
+from qiime2.core.testing.type import SingleInt
+from qiime2.sdk.context import _get_invocation
+
+
+PLUGIN_ACTION = 'dummy-plugin:concatenate_ints'
+
+
+def _make_metadata():
+    return Metadata(pd.DataFrame({'a': ['1', '2']},
+                                 index=pd.Index(['s1', 's2'], name='id')))
+
+
+class TestGetInvocation(unittest.TestCase):
+    def setUp(self):
+        self.md = _make_metadata()
+        self.art1 = Artifact.import_data(SingleInt, 1)
+        self.art2 = Artifact.import_data(SingleInt, 2)
+
+    def test_same_metadata_reuses_invocation(self):
+        first = _get_invocation(PLUGIN_ACTION, {'md': self.md, 'x': 1})
+        second = _get_invocation(PLUGIN_ACTION, {'md': self.md, 'x': 1})
+
+        self.assertIs(first, second)
+
+    def test_different_metadata_does_not_share_invocation(self):
+        other_md = _make_metadata()
+
+        first = _get_invocation(PLUGIN_ACTION, {'md': self.md})
+        second = _get_invocation(PLUGIN_ACTION, {'md': other_md})
+
+        self.assertIsNot(first, second)
+        # The contents are the same, so the invocations still compare equal
+        self.assertEqual(first, second)
+
+    def test_different_artifacts_do_not_share_invocation(self):
+        first = _get_invocation(PLUGIN_ACTION, {'x': self.art1})
+        second = _get_invocation(PLUGIN_ACTION, {'x': self.art2})
+
+        self.assertNotEqual(first, second)
+        self.assertIs(_get_invocation(PLUGIN_ACTION, {'x': self.art1}), first)
+
+    def test_does_not_keep_arguments_alive(self):
+        art = Artifact.import_data(SingleInt, 3)
+        md = _make_metadata()
+        art_ref = weakref.ref(art)
+        md_ref = weakref.ref(md)
+
+        _get_invocation(PLUGIN_ACTION, {'x': art, 'md': md})
+
+        del art, md
+        gc.collect()
+
+        self.assertIsNone(art_ref())
+        self.assertIsNone(md_ref())
+
+    def test_unhashable_arguments(self):
+        first = _get_invocation(PLUGIN_ACTION, {'x': [self.art1, self.art2]})
+        second = _get_invocation(PLUGIN_ACTION, {'x': [self.art1, self.art2]})
+
+        self.assertEqual(first, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
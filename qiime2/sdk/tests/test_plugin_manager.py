@@ -13,6 +13,7 @@ import qiime2.sdk
 from qiime2.plugin.plugin import (SemanticTypeRecord, FormatRecord,
                                   ArtifactClassRecord)
 from qiime2.sdk.plugin_manager import GetFormatFilters
+from qiime2.sdk.context import _resolve_action
 
 from qiime2.core.testing.type import (IntSequence1, IntSequence2, IntSequence3,
                                       Mapping, FourInts, Kennel, Dog, Cat,
@@ -59,6 +60,27 @@ class TestPluginManager(unittest.TestCase):
         }
         self.assertEqual(plugins, exp)
 
+    def test_plugin_changes_clear_action_cache(self):
+        action = _resolve_action('dummy-plugin', 'concatenate_ints')
+        self.assertIs(action, self.plugin.actions['concatenate_ints'])
+        self.assertGreater(_resolve_action.cache_info().currsize, 0)
+
+        test_plugin = qiime2.plugin.Plugin(
+            name='action-cache-test-plugin', version='0.0.1',
+            website='test.com', package='qiime2.sdk.tests',
+            project_name='action_cache_test')
+        try:
+            self.pm.add_plugin(test_plugin)
+            self.assertEqual(_resolve_action.cache_info().currsize, 0)
+
+            _resolve_action('dummy-plugin', 'concatenate_ints')
+            self.assertGreater(_resolve_action.cache_info().currsize, 0)
+        finally:
+            # Adding a plugin changes the singleton, so we need a fresh one
+            self.pm.forget_singleton()
+
+        self.assertEqual(_resolve_action.cache_info().currsize, 0)
+
     def test_validators(self):
         self.assertEqual({Kennel[Dog], Kennel[Cat], AscIntSequence, Squid,
                           Octopus, Cuttlefish},